@@ -1,13 +1,136 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, Response
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, ORJSONResponse
 from groq import Groq
 from dotenv import load_dotenv
+from collections import OrderedDict
+import asyncio
+import gzip
+import hashlib
+import io
 import os
+import threading
+import time
+import uuid
 import random
 from pydantic import BaseModel
 
+try:
+    import orjson
+except Exception:
+    orjson = None
+
+try:
+    import zstandard
+except Exception:
+    zstandard = None
+
 load_dotenv()
 
-app = FastAPI()
+# Dashboards poll /state and /thresholds constantly, so prefer the faster
+# orjson serializer when it is installed.
+ResponseClass = ORJSONResponse if orjson else JSONResponse
+
+app = FastAPI(default_response_class=ResponseClass)
+
+# Study payloads carry the full document text, so accept compressed request
+# bodies and compress larger responses for clients that ask for it.
+MAX_COMPRESSED_BODY = 2 * 1024 * 1024
+MAX_DECOMPRESSED_BODY = 8 * 1024 * 1024
+DECOMPRESS_CHUNK_SIZE = 64 * 1024
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+def open_decompressor(encoding: str, compressed: bytes):
+    if encoding == "gzip":
+        return gzip.GzipFile(fileobj=io.BytesIO(compressed))
+    if encoding == "zstd" and zstandard is not None:
+        # Cap the frame's declared window so it cannot force a large allocation.
+        dctx = zstandard.ZstdDecompressor(max_window_size=MAX_DECOMPRESSED_BODY)
+        return dctx.stream_reader(io.BytesIO(compressed), read_across_frames=True)
+    return None
+
+
+def read_limited(reader) -> bytes:
+    # Inflate in bounded chunks so a small payload cannot expand past the limit.
+    parts = []
+    total = 0
+    while True:
+        chunk = reader.read(DECOMPRESS_CHUNK_SIZE)
+        if not chunk:
+            return b"".join(parts)
+        total += len(chunk)
+        if total > MAX_DECOMPRESSED_BODY:
+            raise BodyTooLarge()
+        parts.append(chunk)
+
+
+class DecompressRequestMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = [(k, v) for k, v in scope["headers"] if k != b"content-encoding"]
+        encoding = dict(scope["headers"]).get(b"content-encoding", b"").decode("latin-1").strip().lower()
+        if encoding in ("", "identity"):
+            await self.app(scope, receive, send)
+            return
+
+        compressed = bytearray()
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            compressed.extend(message.get("body", b""))
+            more_body = message.get("more_body", False)
+            if len(compressed) > MAX_COMPRESSED_BODY:
+                await self.reject(scope, receive, send, 413, "Request body too large.")
+                return
+
+        reader = open_decompressor(encoding, bytes(compressed))
+        if reader is None:
+            await self.reject(scope, receive, send, 415, f"Unsupported content encoding: {encoding}")
+            return
+        try:
+            # Inflating up to MAX_DECOMPRESSED_BODY is CPU work; keep it off the loop.
+            body = await asyncio.to_thread(read_limited, reader)
+        except BodyTooLarge:
+            await self.reject(scope, receive, send, 413, "Decompressed request body too large.")
+            return
+        except Exception:
+            await self.reject(scope, receive, send, 400, "Could not decompress request body.")
+            return
+
+        headers = [(k, v) for k, v in headers if k != b"content-length"]
+        headers.append((b"content-length", str(len(body)).encode("latin-1")))
+        scope = dict(scope, headers=headers)
+
+        sent = False
+
+        async def receive_body():
+            nonlocal sent
+            if sent:
+                return await receive()
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        await self.app(scope, receive_body, send)
+
+    async def reject(self, scope, receive, send, status_code: int, message: str):
+        response = ResponseClass({"detail": message}, status_code=status_code)
+        await response(scope, receive, send)
+
+
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+app.add_middleware(DecompressRequestMiddleware)
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 client = Groq(api_key=GROQ_API_KEY) if GROQ_API_KEY else None
 MODEL_NAME = os.getenv("GROQ_MODEL", "llama-3.1-8b-instant")
@@ -20,6 +143,50 @@ state = {
     "noise": 25
 }
 
+# Monotonic version counter plus the version at which each state key last
+# changed. Reads derive their ETag from the keys they expose. The counter
+# restarts with the process, so ETags also carry a per-process boot id.
+# Sync endpoints run in a threadpool, so state changes and ETag/payload
+# snapshots happen under state_lock.
+BOOT_ID = uuid.uuid4().hex
+state_version = 0
+state_versions = {key: 0 for key in state}
+state_lock = threading.RLock()
+
+# Simulated sensor readings refresh at most this often, so polls in between
+# see unchanged state and can be answered with 304.
+ENVIRONMENT_INTERVAL = float(os.getenv("ENVIRONMENT_INTERVAL", "5"))
+last_environment_update = 0.0
+
+THRESHOLD_KEYS = ("brightness_threshold", "noise_threshold")
+STATE_KEYS = ("brightness", "noise", "brightness_threshold", "noise_threshold", "child_mode")
+
+# Speculative prefetch of the standard study prompts. These must match the
+# study_prompts buttons in neuro_dashboard.py to be served from memory.
+# PREFETCH_MAX_CONCURRENT caps LLM calls in flight across all sessions. Each
+# session only prefetches its latest document, so it never queues more than
+# len(PREFETCH_PROMPTS) tasks; loading new material cancels the old ones.
+PREFETCH_ENABLED = os.getenv("STUDY_PREFETCH", "1") != "0"
+PREFETCH_PROMPTS = (
+    "Summarize this material in simple points.",
+    "Explain the toughest topic in easy words.",
+)
+PREFETCH_MAX_CONCURRENT = 2
+PREFETCH_MAX_DOCUMENTS = 32
+
+# doc hash -> {question: answer}, oldest documents evicted first
+prefetched_answers: OrderedDict[str, dict[str, str]] = OrderedDict()
+# (doc hash, question) -> in-flight task
+prefetch_tasks: dict[tuple[str, str], asyncio.Task] = {}
+# Tasks whose LLM call has started, as opposed to waiting for a slot
+running_prefetches: set[asyncio.Task] = set()
+# session id -> keys of its in-flight tasks, and the reverse mapping; one
+# document per session, entries dropped as tasks finish
+session_prefetches: dict[str, set[tuple[str, str]]] = {}
+prefetch_owners: dict[tuple[str, str], str] = {}
+# Held until the worker thread finishes, not just until the task ends
+prefetch_semaphore = asyncio.Semaphore(PREFETCH_MAX_CONCURRENT)
+
 SYSTEM_PROMPT = (
     "You are a calm, empathetic NeuroLens companion. "
     "Keep responses brief (1-2 sentences), reassuring, and offer one simple coping strategy or question."
@@ -32,6 +199,7 @@ class ChatRequest(BaseModel):
 
 class StudyRequest(BaseModel):
     text: str | None = None
+    session_id: str | None = None
 
 
 class StudyChatRequest(BaseModel):
@@ -109,16 +277,236 @@ def study_fallback_answer(question: str, text: str) -> str:
     return "Upload or paste study text and ask me to summarize, explain, or quiz you."
 
 
+def document_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def request_study_completion(question: str, study_text: str) -> str:
+    if client is None:
+        raise RuntimeError("GROQ_API_KEY is not configured")
+
+    context = study_text[:12000] if study_text else ""
+    completion = client.chat.completions.create(
+        model=MODEL_NAME,
+        messages=[
+            {
+                "role": "system",
+                "content": (
+                    "You are a patient study assistant for children. "
+                    "Explain clearly, keep structure simple, and stay grounded in provided material."
+                ),
+            },
+            {
+                "role": "user",
+                "content": (
+                    f"Study Material:\n{context}\n\n"
+                    f"Question: {question}\n\n"
+                    "If material is missing for the answer, say what is missing."
+                ),
+            },
+        ],
+    )
+    return (completion.choices[0].message.content or "").strip()
+
+
+def ask_study_assistant(question: str, study_text: str) -> str:
+    try:
+        reply = request_study_completion(question, study_text)
+        if not reply:
+            reply = study_fallback_answer(question, study_text)
+    except Exception:
+        reply = study_fallback_answer(question, study_text)
+    return reply
+
+
+def extract_highlights(text: str) -> list[str]:
+    local_points = extract_key_points_locally(text)
+
+    try:
+        if client is None:
+            raise RuntimeError("GROQ_API_KEY is not configured")
+        completion = client.chat.completions.create(
+            model=MODEL_NAME,
+            messages=[
+                {
+                    "role": "system",
+                    "content": "Extract the 5 most important study points as short bullet lines."
+                },
+                {"role": "user", "content": text[:8000]},
+            ],
+        )
+        reply = (completion.choices[0].message.content or "").strip()
+        ai_points = [p.strip("- ").strip() for p in reply.splitlines() if p.strip()][:5]
+        return ai_points or local_points
+    except Exception:
+        return local_points
+
+
+def store_prefetched_answer(doc_hash: str, question: str, answer: str):
+    answers = prefetched_answers.setdefault(doc_hash, {})
+    answers[question] = answer
+    prefetched_answers.move_to_end(doc_hash)
+    while len(prefetched_answers) > PREFETCH_MAX_DOCUMENTS:
+        prefetched_answers.popitem(last=False)
+
+
+def release_prefetch_owner(key: tuple[str, str]):
+    owner = prefetch_owners.pop(key, None)
+    keys = session_prefetches.get(owner)
+    if keys is not None:
+        keys.discard(key)
+        if not keys:
+            del session_prefetches[owner]
+
+
+def release_prefetch_slot(worker: asyncio.Future):
+    prefetch_semaphore.release()
+    if not worker.cancelled():
+        # Mark the result retrieved; failures just mean nothing is cached.
+        worker.exception()
+
+
+async def prefetch_answer(doc_hash: str, question: str, study_text: str):
+    key = (doc_hash, question)
+    task = asyncio.current_task()
+    try:
+        await prefetch_semaphore.acquire()
+        running_prefetches.add(task)
+        # The Groq client is blocking, so run it off the event loop. The slot
+        # is released when the thread finishes, so cancelled prefetches still
+        # count against the budget while their request is in flight.
+        worker = asyncio.ensure_future(asyncio.to_thread(request_study_completion, question, study_text))
+        worker.add_done_callback(release_prefetch_slot)
+        try:
+            answer = await asyncio.shield(worker)
+        except Exception:
+            answer = None
+        # Only cache real completions so a transient failure is retried live.
+        if answer:
+            store_prefetched_answer(doc_hash, question, answer)
+    finally:
+        running_prefetches.discard(task)
+        if prefetch_tasks.get(key) is task:
+            del prefetch_tasks[key]
+            release_prefetch_owner(key)
+
+
+def cancel_session_prefetch(session_id: str) -> int:
+    # Cancelling only discards the result: a Groq request already sent keeps
+    # running in its worker thread until it completes.
+    cancelled = 0
+    for key in session_prefetches.pop(session_id, set()):
+        prefetch_owners.pop(key, None)
+        task = prefetch_tasks.pop(key, None)
+        if task and not task.done():
+            task.cancel()
+            cancelled += 1
+    return cancelled
+
+
+def start_prefetch(study_text: str, session_id: str | None):
+    # Without an LLM the fallback answers are instant, so there is nothing to gain.
+    if not PREFETCH_ENABLED or client is None:
+        return
+
+    doc_hash = document_hash(study_text)
+    session_key = session_id or doc_hash
+    cached = prefetched_answers.get(doc_hash, {})
+    keys = [(doc_hash, q) for q in PREFETCH_PROMPTS if q not in cached]
+
+    # Keep tasks already running for this document and re-parent them to the
+    # session, then cancel whatever else the session had: one document per session.
+    for key in keys:
+        if key in prefetch_tasks:
+            release_prefetch_owner(key)
+    cancel_session_prefetch(session_key)
+
+    for key in keys:
+        if key not in prefetch_tasks:
+            prefetch_tasks[key] = asyncio.create_task(prefetch_answer(*key, study_text))
+        prefetch_owners[key] = session_key
+        session_prefetches.setdefault(session_key, set()).add(key)
+
+
+async def get_prefetched_answer(question: str, study_text: str) -> str | None:
+    doc_hash = document_hash(study_text)
+    answer = prefetched_answers.get(doc_hash, {}).get(question)
+    if answer is not None:
+        return answer
+
+    # A task still queued for a slot may sit behind other sessions' calls;
+    # answering live is faster than waiting for it.
+    task = prefetch_tasks.get((doc_hash, question))
+    if task is None or task not in running_prefetches:
+        return None
+    try:
+        # Shield so a dropped request does not cancel the shared prefetch.
+        await asyncio.shield(task)
+    except asyncio.CancelledError:
+        if not task.cancelled():
+            raise
+        return None
+    return prefetched_answers.get(doc_hash, {}).get(question)
+
+
+def update_state(**values) -> bool:
+    # Only bump the version for values that actually change, so repeated
+    # writes of the same value are idempotent and cached reads stay valid.
+    global state_version
+    with state_lock:
+        changed = [key for key, value in values.items() if state.get(key) != value]
+        if not changed:
+            return False
+        state_version += 1
+        for key in changed:
+            state[key] = values[key]
+            state_versions[key] = state_version
+        return True
+
+
+def make_etag(keys) -> str:
+    return f'W/"{BOOT_ID}-{max(state_versions[k] for k in keys)}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match", "")
+    if header.strip() == "*":
+        return True
+    # Weak comparison: ignore the W/ prefix on either side.
+    wanted = etag.removeprefix("W/")
+    return any(t.strip().removeprefix("W/") == wanted for t in header.split(",") if t.strip())
+
+
+def conditional_response(request: Request, keys, payload_fn):
+    with state_lock:
+        etag = make_etag(keys)
+        if etag_matches(request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        payload = payload_fn()
+    return ResponseClass(payload, headers={"ETag": etag})
+
+
+def refresh_environment():
+    global last_environment_update
+    with state_lock:
+        now = time.monotonic()
+        if now - last_environment_update < ENVIRONMENT_INTERVAL:
+            return
+        last_environment_update = now
+        generate_environment()
+
+
 def generate_environment():
 
     base_brightness = random.randint(35, 75)
     base_noise = random.randint(20, 60)
+    mode = state["child_mode"]
 
-    if state["child_mode"] == "Calm":
+    if mode == "Calm":
         brightness = base_brightness - 20
         noise = base_noise - 20
 
-    elif state["child_mode"] == "Focus":
+    elif mode == "Focus":
         brightness = min(65, base_brightness)
         noise = base_noise - 10
 
@@ -126,86 +514,84 @@ def generate_environment():
         brightness = base_brightness
         noise = base_noise
 
-    state["brightness"] = max(10, brightness)
-    state["noise"] = max(10, noise)
+    update_state(brightness=max(10, brightness), noise=max(10, noise))
 
 
 @app.post("/detect-thresholds")
 def detect_thresholds():
     # Mock detection: pick thresholds based on current child mode and vary readings
-    mode = state.get("child_mode", "Neutral")
-    base_b = state.get("brightness", 50)
-    base_n = state.get("noise", 40)
-
-    if mode == "Calm":
-        b = max(10, base_b - random.randint(10, 20))
-        n = max(10, base_n - random.randint(5, 15))
-    elif mode == "Focus":
-        b = min(85, base_b + random.randint(0, 10))
-        n = max(10, base_n - random.randint(5, 10))
-    else:
-        b = max(10, base_b - random.randint(0, 10))
-        n = max(10, base_n - random.randint(0, 5))
-
-    state["brightness_threshold"] = b
-    state["noise_threshold"] = n
-
-    # Simulate current sensor readings that vary around thresholds
-    state["brightness"] = min(100, b + random.randint(-5, 15))
-    state["noise"] = max(0, n + random.randint(-5, 10))
+    with state_lock:
+        mode = state.get("child_mode", "Neutral")
+        base_b = state.get("brightness", 50)
+        base_n = state.get("noise", 40)
+
+        if mode == "Calm":
+            b = max(10, base_b - random.randint(10, 20))
+            n = max(10, base_n - random.randint(5, 15))
+        elif mode == "Focus":
+            b = min(85, base_b + random.randint(0, 10))
+            n = max(10, base_n - random.randint(5, 10))
+        else:
+            b = max(10, base_b - random.randint(0, 10))
+            n = max(10, base_n - random.randint(0, 5))
+
+        # Simulate current sensor readings that vary around thresholds
+        update_state(
+            brightness_threshold=b,
+            noise_threshold=n,
+            brightness=min(100, b + random.randint(-5, 15)),
+            noise=max(0, n + random.randint(-5, 10)),
+        )
 
     return {"brightness": b, "noise": n}
 
 
 @app.get("/thresholds")
-def get_thresholds():
-    return {
+def get_thresholds(request: Request):
+    return conditional_response(request, THRESHOLD_KEYS, lambda: {
         "brightness": state.get("brightness_threshold", 50),
         "noise": state.get("noise_threshold", 40),
-    }
+    })
 
 
 @app.post("/set-environment")
 def set_environment(brightness: int, noise: int):
-    state["brightness"] = brightness
-    state["noise"] = noise
+    update_state(brightness=brightness, noise=noise)
     return {"status": "environment updated"}
 
 @app.post("/set-child-mode")
 def set_child_mode(mode: str):
-    state["child_mode"] = mode
-    return {"child_mode": mode}
+    changed = update_state(child_mode=mode)
+    return {"child_mode": mode, "changed": changed}
 
 @app.post("/set-thresholds")
 def set_thresholds(brightness: int, noise: int):
-    state["brightness_threshold"] = brightness
-    state["noise_threshold"] = noise
+    update_state(brightness_threshold=brightness, noise_threshold=noise)
     return {"status": "thresholds updated"}
 
 @app.post("/auto-adjust")
 def auto_adjust():
     # Actively reduce environment values to slightly below thresholds for comfort
-    bt = state.get("brightness_threshold", 50)
-    nt = state.get("noise_threshold", 40)
-
-    # target values: a small margin below threshold
-    target_b = max(10, bt - 5)
-    target_n = max(10, nt - 3)
-
-    state["brightness"] = min(state.get("brightness", target_b), target_b)
-    state["noise"] = min(state.get("noise", target_n), target_n)
+    with state_lock:
+        bt = state.get("brightness_threshold", 50)
+        nt = state.get("noise_threshold", 40)
 
-    return {
-        "status": "adjusted",
-        "brightness": state["brightness"],
-        "noise": state["noise"]
-    }
+        # target values: a small margin below threshold
+        target_b = max(10, bt - 5)
+        target_n = max(10, nt - 3)
 
-@app.get("/state")
-def get_state():
+        update_state(
+            brightness=min(state.get("brightness", target_b), target_b),
+            noise=min(state.get("noise", target_n), target_n),
+        )
 
-    generate_environment()
+        return {
+            "status": "adjusted",
+            "brightness": state["brightness"],
+            "noise": state["noise"]
+        }
 
+def state_payload():
     exceeded = (
         state["brightness"] > state["brightness_threshold"] or
         state["noise"] > state["noise_threshold"]
@@ -217,10 +603,19 @@ def get_state():
         "brightness_threshold": state["brightness_threshold"],
         "noise_threshold": state["noise_threshold"],
         "child_mode": state["child_mode"],
-        "exceeded": exceeded
+        "exceeded": exceeded,
+        "version": state_version,
     }
 
 
+@app.get("/state")
+def get_state(request: Request):
+
+    refresh_environment()
+
+    return conditional_response(request, STATE_KEYS, state_payload)
+
+
 @app.get("/healthz")
 def healthz():
     return {"status": "ok"}
@@ -263,26 +658,9 @@ async def study_highlights(payload: StudyRequest):
     if not text:
         return {"highlights": [], "message": "No study text provided."}
 
-    local_points = extract_key_points_locally(text)
-
-    try:
-        if client is None:
-            raise RuntimeError("GROQ_API_KEY is not configured")
-        completion = client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=[
-                {
-                    "role": "system",
-                    "content": "Extract the 5 most important study points as short bullet lines."
-                },
-                {"role": "user", "content": text[:8000]},
-            ],
-        )
-        reply = (completion.choices[0].message.content or "").strip()
-        ai_points = [p.strip("- ").strip() for p in reply.splitlines() if p.strip()][:5]
-        points = ai_points or local_points
-    except Exception:
-        points = local_points
+    start_prefetch(text, payload.session_id)
+    # Run the blocking Groq call in a thread so prefetches overlap with it.
+    points = await asyncio.to_thread(extract_highlights, text)
 
     return {"highlights": points}
 
@@ -295,35 +673,14 @@ async def study_chat(payload: StudyChatRequest):
     if not question:
         return {"reply": "Please ask a study question."}
 
-    try:
-        if client is None:
-            raise RuntimeError("GROQ_API_KEY is not configured")
-
-        context = study_text[:12000] if study_text else ""
-        completion = client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        "You are a patient study assistant for children. "
-                        "Explain clearly, keep structure simple, and stay grounded in provided material."
-                    ),
-                },
-                {
-                    "role": "user",
-                    "content": (
-                        f"Study Material:\n{context}\n\n"
-                        f"Question: {question}\n\n"
-                        "If material is missing for the answer, say what is missing."
-                    ),
-                },
-            ],
-        )
-        reply = (completion.choices[0].message.content or "").strip()
-        if not reply:
-            reply = study_fallback_answer(question, study_text)
-    except Exception:
-        reply = study_fallback_answer(question, study_text)
+    reply = await get_prefetched_answer(question, study_text)
+    if reply is None:
+        reply = await asyncio.to_thread(ask_study_assistant, question, study_text)
 
     return {"reply": reply}
+
+
+@app.post("/study/cancel-prefetch")
+async def cancel_prefetch(session_id: str):
+    # async so prefetch bookkeeping and Task.cancel() stay on the event loop
+    return {"cancelled": cancel_session_prefetch(session_id)}
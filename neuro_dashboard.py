@@ -1,5 +1,8 @@
+import gzip
+import json
 import os
 import tempfile
+import uuid
 from io import BytesIO
 
 import requests
@@ -22,6 +25,9 @@ except Exception:
 
 API = (api_from_secrets or os.getenv("API_URL") or "http://127.0.0.1:8000").rstrip("/")
 
+# Study payloads above this size are gzip-compressed before upload.
+COMPRESS_MIN_BYTES = 16 * 1024
+
 
 def extract_uploaded_text(uploaded_file) -> str:
     if not uploaded_file:
@@ -61,15 +67,40 @@ def extract_uploaded_text(uploaded_file) -> str:
     return ""
 
 
+def get_cached_json(path: str, timeout: int = 5) -> dict:
+    # Conditional GET: replay the last ETag so unchanged polls return 304
+    # and reuse the payload cached in session state.
+    cache = st.session_state.setdefault("api_cache", {})
+    cached = cache.get(path)
+    headers = {"If-None-Match": cached["etag"]} if cached else {}
+    resp = requests.get(f"{API}{path}", headers=headers, timeout=timeout)
+    if resp.status_code == 304 and cached:
+        return cached["data"]
+    data = resp.json()
+    etag = resp.headers.get("ETag")
+    if etag:
+        cache[path] = {"etag": etag, "data": data}
+    return data
+
+
+def post_json(path: str, payload: dict, timeout: int):
+    body = json.dumps(payload).encode("utf-8")
+    headers = {"Content-Type": "application/json"}
+    if len(body) >= COMPRESS_MIN_BYTES:
+        body = gzip.compress(body, compresslevel=6)
+        headers["Content-Encoding"] = "gzip"
+    return requests.post(f"{API}{path}", data=body, headers=headers, timeout=timeout)
+
+
 def send_study_question(question: str):
     st.session_state.study_chat_history.append({"role": "user", "message": question})
     with st.chat_message("user"):
         st.write(question)
 
     try:
-        resp = requests.post(
-            f"{API}/study/chat",
-            json={
+        resp = post_json(
+            "/study/chat",
+            {
                 "question": question,
                 "text": st.session_state.get("study_text", ""),
             },
@@ -127,7 +158,7 @@ elif st.session_state.role == "Parent / Caregiver":
     st.subheader("Environment State")
 
     try:
-        data = requests.get(f"{API}/state", timeout=5).json()
+        data = get_cached_json("/state")
         st.metric("Brightness", f'{data["brightness"]}%')
         st.metric("Noise", f'{data["noise"]} dB')
 
@@ -250,7 +281,7 @@ else:
         st.warning("Could not update mode right now.")
 
     try:
-        data = requests.get(f"{API}/state", timeout=5).json()
+        data = get_cached_json("/state")
         st.metric("Brightness", f'{data["brightness"]}%')
         st.metric("Noise", f'{data["noise"]} dB')
         if data["exceeded"]:
@@ -270,6 +301,8 @@ else:
             st.session_state.study_highlights = []
         if "study_chat_history" not in st.session_state:
             st.session_state.study_chat_history = []
+        if "session_id" not in st.session_state:
+            st.session_state.session_id = uuid.uuid4().hex
 
         uploaded_file = st.file_uploader(
             "Upload document",
@@ -287,9 +320,9 @@ else:
                 st.warning("Please upload a document or paste some text first.")
             else:
                 try:
-                    resp = requests.post(
-                        f"{API}/study/highlights",
-                        json={"text": final_text},
+                    resp = post_json(
+                        "/study/highlights",
+                        {"text": final_text, "session_id": st.session_state.session_id},
                         timeout=20,
                     )
                     if resp.ok:
@@ -373,5 +406,14 @@ else:
             send_user_message(user_msg)
 
     if st.button("Switch User"):
+        if "session_id" in st.session_state:
+            try:
+                requests.post(
+                    f"{API}/study/cancel-prefetch",
+                    params={"session_id": st.session_state.session_id},
+                    timeout=5,
+                )
+            except requests.RequestException:
+                pass
         del st.session_state.role
         st.rerun()
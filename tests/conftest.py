@@ -0,0 +1,25 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import backend
+
+
+INITIAL_STATE = dict(backend.state)
+
+
+@pytest.fixture(autouse=True)
+def reset_state(monkeypatch):
+    backend.state.clear()
+    backend.state.update(INITIAL_STATE)
+    monkeypatch.setattr(backend, "state_version", 0)
+    monkeypatch.setattr(backend, "state_versions", {key: 0 for key in backend.state})
+    # Keep the simulated environment still unless a test advances it.
+    monkeypatch.setattr(backend, "ENVIRONMENT_INTERVAL", 3600.0)
+    monkeypatch.setattr(backend, "last_environment_update", 0.0)
+    monkeypatch.setattr(backend, "client", None)
+
+
+@pytest.fixture
+def api():
+    with TestClient(backend.app) as test_client:
+        yield test_client
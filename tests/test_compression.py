@@ -0,0 +1,99 @@
+import gzip
+import json
+
+import pytest
+import zstandard
+
+import backend
+
+
+TEXT = "Plants need light. " * 2000
+
+
+def post(api, path, body, encoding):
+    return api.post(
+        path,
+        content=body,
+        headers={"Content-Type": "application/json", "Content-Encoding": encoding},
+    )
+
+
+def payload(text=TEXT):
+    return json.dumps({"text": text}).encode("utf-8")
+
+
+def test_gzip_request_body(api):
+    resp = post(api, "/study/highlights", gzip.compress(payload()), "gzip")
+    assert resp.status_code == 200
+    assert resp.json()["highlights"]
+
+
+def test_zstd_request_body(api):
+    resp = post(api, "/study/highlights", zstandard.ZstdCompressor().compress(payload()), "zstd")
+    assert resp.status_code == 200
+    assert resp.json()["highlights"]
+
+
+def test_zstd_multi_frame_body(api):
+    raw = payload()
+    cctx = zstandard.ZstdCompressor()
+    body = cctx.compress(raw[:1000]) + cctx.compress(raw[1000:])
+
+    resp = post(api, "/study/highlights", body, "zstd")
+    assert resp.status_code == 200
+    assert resp.json()["highlights"]
+
+
+@pytest.mark.parametrize("compress, encoding", [
+    (gzip.compress, "gzip"),
+    (zstandard.ZstdCompressor().compress, "zstd"),
+])
+def test_compression_bomb_rejected(api, compress, encoding):
+    bomb = compress(payload("a" * (backend.MAX_DECOMPRESSED_BODY + 1)))
+    assert len(bomb) < backend.MAX_COMPRESSED_BODY
+
+    resp = post(api, "/study/highlights", bomb, encoding)
+    assert resp.status_code == 413
+
+
+def test_oversized_compressed_body_rejected(api, monkeypatch):
+    monkeypatch.setattr(backend, "MAX_COMPRESSED_BODY", 100)
+    resp = post(api, "/study/highlights", gzip.compress(payload()), "gzip")
+    assert resp.status_code == 413
+
+
+def test_zstd_large_window_rejected(api):
+    # Streaming compression leaves the content size unknown, so the frame
+    # declares the full 128 MB window.
+    params = zstandard.ZstdCompressionParameters(window_log=27)
+    cobj = zstandard.ZstdCompressor(compression_params=params).compressobj()
+    frame = cobj.compress(payload("tiny")) + cobj.flush()
+    assert zstandard.get_frame_parameters(frame).window_size > backend.MAX_DECOMPRESSED_BODY
+
+    assert post(api, "/study/highlights", frame, "zstd").status_code == 400
+
+
+def test_unknown_encoding_rejected(api):
+    resp = post(api, "/study/highlights", payload(), "br")
+    assert resp.status_code == 415
+
+
+@pytest.mark.parametrize("encoding", ["gzip", "zstd"])
+def test_corrupt_body_rejected(api, encoding):
+    resp = post(api, "/study/highlights", b"not compressed at all", encoding)
+    assert resp.status_code == 400
+
+
+def test_large_response_gzipped_when_accepted(api):
+    resp = api.post(
+        "/study/highlights",
+        json={"text": ". ".join(f"Key idea {i} " + "about plants " * 20 for i in range(5))},
+        headers={"Accept-Encoding": "gzip"},
+    )
+    assert resp.status_code == 200
+    assert resp.headers.get("Content-Encoding") == "gzip"
+
+
+def test_small_response_not_gzipped(api):
+    resp = api.get("/healthz", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in resp.headers
@@ -0,0 +1,205 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import backend
+
+
+SUMMARY, EXPLAIN = backend.PREFETCH_PROMPTS
+
+
+class FakeCompletions:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = []
+        self.active = 0
+        self.max_active = 0
+        self.gate = threading.Event()
+        self.gate.set()
+        self.fail = False
+        self.highlights_wait_for_prefetch = False
+        self.overlapped = False
+
+    def create(self, model, messages):
+        prompt = messages[-1]["content"]
+        with self.lock:
+            self.calls.append(prompt)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            if messages[0]["content"].startswith("Extract"):
+                if self.highlights_wait_for_prefetch:
+                    deadline = time.monotonic() + 2
+                    while len(self.study_calls()) < 2 and time.monotonic() < deadline:
+                        time.sleep(0.01)
+                    self.overlapped = len(self.study_calls()) == 2
+                return self.reply("- highlight")
+            self.gate.wait(5)
+            if self.fail:
+                raise RuntimeError("rate limited")
+            question = prompt.split("Question: ")[1].split("\n")[0]
+            return self.reply(f"LLM: {question}")
+        finally:
+            with self.lock:
+                self.active -= 1
+
+    def study_calls(self):
+        with self.lock:
+            return [c for c in self.calls if "Question: " in c]
+
+    @staticmethod
+    def reply(content):
+        message = type("Message", (), {"content": content})
+        choice = type("Choice", (), {"message": message})
+        return type("Completion", (), {"choices": [choice]})
+
+
+class FakeClient:
+    def __init__(self):
+        self.chat = type("Chat", (), {})()
+        self.chat.completions = FakeCompletions()
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    fake = FakeClient()
+    monkeypatch.setattr(backend, "client", fake)
+    monkeypatch.setattr(backend, "PREFETCH_ENABLED", True)
+    monkeypatch.setattr(backend, "prefetched_answers", backend.OrderedDict())
+    monkeypatch.setattr(backend, "prefetch_tasks", {})
+    monkeypatch.setattr(backend, "running_prefetches", set())
+    monkeypatch.setattr(backend, "session_prefetches", {})
+    monkeypatch.setattr(backend, "prefetch_owners", {})
+    # The semaphore binds to the event loop it first waits on; each
+    # TestClient runs its own loop.
+    monkeypatch.setattr(backend, "prefetch_semaphore", asyncio.Semaphore(backend.PREFETCH_MAX_CONCURRENT))
+    yield fake.chat.completions
+    fake.chat.completions.gate.set()
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.01)
+
+
+def load(api, text, session_id="s1"):
+    resp = api.post("/study/highlights", json={"text": text, "session_id": session_id})
+    assert resp.status_code == 200
+    return resp.json()
+
+
+def ask(api, question, text):
+    return api.post("/study/chat", json={"question": question, "text": text}).json()["reply"]
+
+
+def test_prefetched_answer_served_without_llm_call(api, llm):
+    assert load(api, "Photosynthesis makes sugar.")["highlights"] == ["highlight"]
+    doc_hash = backend.document_hash("Photosynthesis makes sugar.")
+    wait_for(lambda: len(backend.prefetched_answers.get(doc_hash, {})) == 2)
+    assert len(llm.study_calls()) == 2
+
+    assert ask(api, SUMMARY, "Photosynthesis makes sugar.") == f"LLM: {SUMMARY}"
+    assert ask(api, EXPLAIN, "Photosynthesis makes sugar.") == f"LLM: {EXPLAIN}"
+    assert len(llm.study_calls()) == 2
+    wait_for(lambda: not backend.prefetch_tasks and not backend.session_prefetches)
+
+
+def test_prefetch_overlaps_highlights_call(api, llm):
+    llm.highlights_wait_for_prefetch = True
+    load(api, "Volcanoes erupt.")
+    assert llm.overlapped
+
+
+def test_chat_awaits_running_prefetch(api, llm):
+    llm.gate.clear()
+    load(api, "Cells divide.")
+    wait_for(lambda: len(llm.study_calls()) == 2)
+
+    threading.Timer(0.1, llm.gate.set).start()
+    assert ask(api, SUMMARY, "Cells divide.") == f"LLM: {SUMMARY}"
+    assert len(llm.study_calls()) == 2
+
+
+def test_reloading_same_document_keeps_running_tasks(api, llm):
+    llm.gate.clear()
+    load(api, "Atoms bond.")
+    wait_for(lambda: len(llm.study_calls()) == 2)
+    load(api, "Atoms bond.")
+
+    assert len(backend.prefetch_tasks) == 2
+    llm.gate.set()
+    assert ask(api, SUMMARY, "Atoms bond.") == f"LLM: {SUMMARY}"
+    wait_for(lambda: not backend.prefetch_tasks)
+    assert len(llm.study_calls()) == 2
+
+
+def test_failed_prefetch_is_not_cached(api, llm):
+    llm.fail = True
+    load(api, "Gravity pulls.")
+    wait_for(lambda: len(llm.study_calls()) == 2 and not backend.prefetch_tasks)
+    assert not backend.prefetched_answers
+
+    llm.fail = False
+    assert ask(api, SUMMARY, "Gravity pulls.") == f"LLM: {SUMMARY}"
+    assert len(llm.study_calls()) == 3
+
+
+def test_cancel_session_keeps_slots_until_threads_finish(api, llm):
+    llm.gate.clear()
+    load(api, "Rivers flow.")
+    wait_for(lambda: len(llm.study_calls()) == 2)
+
+    assert api.post("/study/cancel-prefetch", params={"session_id": "s1"}).json() == {"cancelled": 2}
+    assert not backend.prefetch_tasks
+    assert not backend.session_prefetches
+    assert backend.prefetch_semaphore.locked()
+
+    llm.gate.set()
+    wait_for(lambda: not backend.prefetch_semaphore.locked())
+    assert not backend.prefetched_answers
+
+
+def test_new_material_cancels_previous_document(api, llm):
+    llm.gate.clear()
+    load(api, "First text.")
+    wait_for(lambda: len(llm.study_calls()) == 2)
+    load(api, "Second text.")
+
+    first = backend.document_hash("First text.")
+    second = backend.document_hash("Second text.")
+    assert {key[0] for key in backend.prefetch_tasks} == {second}
+    assert backend.session_prefetches["s1"] == {(second, SUMMARY), (second, EXPLAIN)}
+
+    llm.gate.set()
+    wait_for(lambda: second in backend.prefetched_answers)
+    assert first not in backend.prefetched_answers
+
+
+def test_budget_caps_concurrent_calls_and_queued_tasks_answer_live(api, llm):
+    llm.gate.clear()
+    load(api, "Doc A.", session_id="a")
+    load(api, "Doc B.", session_id="b")
+    wait_for(lambda: len(llm.study_calls()) == 2)
+    assert len(backend.prefetch_tasks) == 4
+    assert len(backend.running_prefetches) == 2
+
+    # Doc B's tasks are queued behind doc A's, so the click answers live.
+    queued = next(t for k, t in backend.prefetch_tasks.items() if k[0] == backend.document_hash("Doc B."))
+    assert queued not in backend.running_prefetches
+    replies = []
+    click = threading.Thread(target=lambda: replies.append(ask(api, SUMMARY, "Doc B.")))
+    click.start()
+    # The live call starts while doc A's prefetches still hold both slots.
+    wait_for(lambda: len(llm.study_calls()) == 3)
+    llm.gate.set()
+    click.join(5)
+    assert replies == [f"LLM: {SUMMARY}"]
+
+    wait_for(lambda: not backend.prefetch_tasks)
+    # Two prefetch slots plus the live click.
+    assert llm.max_active == backend.PREFETCH_MAX_CONCURRENT + 1
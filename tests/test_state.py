@@ -0,0 +1,92 @@
+import threading
+
+import backend
+
+
+def test_state_returns_etag_and_304_when_unchanged(api):
+    first = api.get("/state")
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+    assert etag.startswith(f'W/"{backend.BOOT_ID}-')
+
+    second = api.get("/state", headers={"If-None-Match": etag})
+    assert second.status_code == 304
+    assert second.headers["ETag"] == etag
+    assert second.content == b""
+
+
+def test_state_etag_changes_after_write(api):
+    etag = api.get("/state").headers["ETag"]
+
+    api.post("/set-environment", params={"brightness": 77, "noise": 33})
+
+    resp = api.get("/state", headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+    assert resp.headers["ETag"] != etag
+    assert resp.json()["brightness"] == 77
+
+
+def test_state_refreshes_environment_after_interval(api, monkeypatch):
+    etag = api.get("/state").headers["ETag"]
+    monkeypatch.setattr(backend, "generate_environment", lambda: backend.update_state(brightness=99))
+    monkeypatch.setattr(backend, "last_environment_update", -backend.ENVIRONMENT_INTERVAL)
+
+    resp = api.get("/state", headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+    assert resp.json()["brightness"] == 99
+
+
+def test_etag_from_previous_process_does_not_match(api):
+    api.get("/state")
+    version = backend.state_version
+    stale = f'W/"otherboot-{version}"'
+
+    assert api.get("/state", headers={"If-None-Match": stale}).status_code == 200
+
+
+def test_etag_weak_comparison_and_lists(api):
+    etag = api.get("/thresholds").headers["ETag"]
+    strong = etag.removeprefix("W/")
+
+    assert api.get("/thresholds", headers={"If-None-Match": strong}).status_code == 304
+    assert api.get("/thresholds", headers={"If-None-Match": f'"x", {etag}'}).status_code == 304
+    assert api.get("/thresholds", headers={"If-None-Match": "*"}).status_code == 304
+
+
+def test_thresholds_etag_ignores_environment_changes(api):
+    etag = api.get("/thresholds").headers["ETag"]
+
+    api.post("/set-environment", params={"brightness": 90, "noise": 90})
+    assert api.get("/thresholds", headers={"If-None-Match": etag}).status_code == 304
+
+    api.post("/set-thresholds", params={"brightness": 10, "noise": 10})
+    resp = api.get("/thresholds", headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+    assert resp.json() == {"brightness": 10, "noise": 10}
+
+
+def test_unchanged_writes_do_not_bump_version(api):
+    first = api.post("/set-child-mode", params={"mode": "Calm"}).json()
+    version = backend.state_version
+    second = api.post("/set-child-mode", params={"mode": "Calm"}).json()
+
+    assert first["changed"] is True
+    assert second["changed"] is False
+    assert backend.state_version == version
+
+    api.post("/set-thresholds", params={"brightness": 50, "noise": 40})
+    assert backend.state_version == version
+
+
+def test_concurrent_writes_get_distinct_versions():
+    def writer(offset):
+        for i in range(200):
+            backend.update_state(brightness=offset * 1000 + i)
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert backend.state_version == 8 * 200